@@ -1,17 +1,94 @@
 import os
 import sys
-import subprocess
+import asyncio
+import csv
+import io
 import json
+import re
 import shutil
-import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Dict, Optional, Tuple
+from functools import lru_cache, partial
+from itertools import accumulate, groupby
+from operator import attrgetter
+from typing import List, Dict, Optional, Tuple, BinaryIO, Callable, Iterable, Iterator, TextIO
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree
 from rich.console import Console
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 console = Console()
 
+DEFAULT_MODEL = "qwen2.5-coder:1.5b-instruct-q4_K_M"
+
+_TOKEN_RE = re.compile(r"""(?P<literal>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(?P<ident>\b[A-Za-z_]\w*\b)""")
+_NUMBER_RE = re.compile(r"\d+")
+_PLACEHOLDER_RE = re.compile(r"\0(\d+)\0")
+_INDENT_RE = re.compile(r"[ \t]*")
+
+_PROMPT_HEAD = (
+    "You are a secure C/C++ coding expert. Fix ONLY the reported vulnerability on each TARGET line, "
+    "keeping its logic, names and structure. Give the fixed line without indentation.\n"
+)
+_FIX_PROMPT_TAIL = 'RETURN JSON: {"reason": "<brief explanation>", "fixed_line": "<fixed line>"}'
+_BATCH_PROMPT_TAIL = (
+    'RETURN JSON with one entry per LINE: '
+    '{"fixes": [{"line": <LINE>, "reason": "<brief explanation>", "fixed_line": "<fixed line>"}]}'
+)
+
+_CPPCHECK_SOURCE_SUFFIXES = {".c", ".cc", ".cpp", ".cxx", ".c++", ".tpp", ".txx"}
+
+_FIX_RULES = [
+    ("gets", re.compile(r"\bgets\s*\(\s*([A-Za-z_]\w*)\s*\)"), r"fgets(\1, sizeof(\1), stdin)",
+     "gets() has no bounds check; fgets() is limited to the buffer size"),
+    ("strcpy", re.compile(r"\bstrcpy\s*\(\s*([A-Za-z_]\w*)\s*,"), r'snprintf(\1, sizeof(\1), "%s",',
+     "strcpy() has no bounds check; snprintf() truncates to the buffer size"),
+    ("strcat", re.compile(r"\bstrcat\s*\(\s*([A-Za-z_]\w*)\s*,\s*([^()]+?)\s*\)"),
+     r"strncat(\1, \2, sizeof(\1) - strlen(\1) - 1)",
+     "strcat() has no bounds check; strncat() is limited to the space left in the buffer"),
+    ("sprintf", re.compile(r"\bsprintf\s*\(\s*([A-Za-z_]\w*)\s*,"), r"snprintf(\1, sizeof(\1),",
+     "sprintf() has no bounds check; snprintf() truncates to the buffer size"),
+    ("vsprintf", re.compile(r"\bvsprintf\s*\(\s*([A-Za-z_]\w*)\s*,"), r"vsnprintf(\1, sizeof(\1),",
+     "vsprintf() has no bounds check; vsnprintf() truncates to the buffer size"),
+]
+
+_SEVERITY_RANK = {"error": 5, "warning": 4, "portability": 3, "performance": 3, "style": 2, "information": 1}
+
+def _severity_rank(severity: str) -> int:
+    if severity.isdigit():
+        return int(severity)
+    return _SEVERITY_RANK.get(severity, 0)
+
+class _TeeReader:
+    def __init__(self, source: BinaryIO, copy: BinaryIO):
+        self.source = source
+        self.copy = copy
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read1(size) if size > 0 else self.source.read()
+        self.copy.write(data)
+        return data
+
+def _tee_lines(source: Iterable[str], copy: TextIO) -> Iterator[str]:
+    for line in source:
+        copy.write(line)
+        yield line
+
+def _has_fixed_line(fix_data: object) -> bool:
+    return isinstance(fix_data, dict) and isinstance(fix_data.get('fixed_line'), str)
+
+@lru_cache(maxsize=4096)
+def _resolve(path: str) -> str:
+    return str(Path(path).resolve())
+
 @dataclass
 class Vulnerability:
     tool: str
@@ -22,154 +99,398 @@ class Vulnerability:
     column: Optional[int] = None
 
 class StaticAnalyzer:
-    def __init__(self, source_dir: Path, output_dir: Path):
+    def __init__(self, source_dir: Path, output_dir: Path, jobs: Optional[int] = None):
         self.source_dir = source_dir
+        self.jobs = jobs or os.cpu_count() or 1
         self.reports_dir = output_dir / "reports"
         self.reports_dir.mkdir(parents=True, exist_ok=True)
 
     def run_all(self) -> List[Vulnerability]:
-        vulnerabilities = []
-        vulnerabilities.extend(self._run_cppcheck())
-        vulnerabilities.extend(self._run_flawfinder())
-        return vulnerabilities
+        return asyncio.run(self._run_all_async())
+
+    async def _run_all_async(self) -> List[Vulnerability]:
+        results = await asyncio.gather(self._run_cppcheck(), self._run_flawfinder())
+        return [vuln for tool_vulns in results for vuln in tool_vulns]
+
+    async def _run_streaming(self, cmd: List[str], parse: Callable[[BinaryIO], List[Vulnerability]],
+                             report_on_stderr: bool = False) -> List[Vulnerability]:
+        read_fd, write_fd = os.pipe()
+        try:
+            if report_on_stderr:
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=write_fd
+                )
+            else:
+                proc = await asyncio.create_subprocess_exec(*cmd, stdout=write_fd)
+        except FileNotFoundError:
+            os.close(read_fd)
+            console.print(f"[red]{cmd[0]}: not found, skipping[/red]")
+            return []
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+
+        loop = asyncio.get_running_loop()
+        with open(read_fd, "rb") as pipe:
+            vulns = await loop.run_in_executor(None, parse, pipe)
+        await proc.wait()
+        return vulns
+
+    async def _run_cppcheck(self) -> List[Vulnerability]:
+        shards = self._cppcheck_shards()
+        if len(shards) <= 1:
+            return await self._run_cppcheck_shard([str(self.source_dir)], self.reports_dir / "cppcheck.xml", self.jobs)
+
+        total_sources = sum(source_count for _, source_count in shards)
+        semaphore = asyncio.Semaphore(self.jobs)
+
+        async def run_shard(index: int, paths: List[str], source_count: int) -> List[Vulnerability]:
+            jobs = max(1, round(self.jobs * source_count / total_sources))
+            async with semaphore:
+                return await self._run_cppcheck_shard(paths, self.reports_dir / f"cppcheck_shard_{index}.xml", jobs)
 
-    def _run_cppcheck(self) -> List[Vulnerability]:
-        xml_path = self.reports_dir / "cppcheck.xml"
+        results = await asyncio.gather(*(
+            run_shard(i, paths, source_count) for i, (paths, source_count) in enumerate(shards)
+        ))
+        return [vuln for shard_vulns in results for vuln in shard_vulns]
+
+    def _cppcheck_shards(self) -> List[Tuple[List[str], int]]:
+        shards = []
+        root_sources = []
+        for item in sorted(self.source_dir.iterdir()):
+            if item.is_dir():
+                if item == self.reports_dir:
+                    continue
+                source_count = sum(
+                    1 for _, _, files in os.walk(item) for name in files
+                    if os.path.splitext(name)[1].lower() in _CPPCHECK_SOURCE_SUFFIXES
+                )
+                if source_count:
+                    shards.append(([str(item)], source_count))
+            elif item.suffix.lower() in _CPPCHECK_SOURCE_SUFFIXES:
+                root_sources.append(str(item))
+        if root_sources:
+            shards.append((root_sources, len(root_sources)))
+        return shards
+
+    async def _run_cppcheck_shard(self, paths: List[str], xml_path: Path, jobs: int) -> List[Vulnerability]:
         cmd = [
-            "cppcheck", "--enable=warning,performance,portability,style", 
+            "cppcheck", f"-j{jobs}", "--enable=warning,performance,portability,style",
             "--inconclusive", "--xml", "--xml-version=2", 
-            str(self.source_dir)
+            *paths
         ]
-        
-        with open(xml_path, "w") as f:
-            subprocess.run(cmd, stderr=f, stdout=subprocess.DEVNULL)
+        return await self._run_streaming(cmd, partial(self._parse_cppcheck, xml_path), report_on_stderr=True)
 
+    def _parse_cppcheck(self, xml_path: Path, pipe: BinaryIO) -> List[Vulnerability]:
         vulns = []
-        try:
-            tree = ET.parse(xml_path)
-            root = tree.getroot()
-            for error in root.iter("error"):
-                location = error.find("location")
-                if location is not None:
-                    file_path = location.get("file")
-                    if file_path:
-                        abs_path = str(Path(file_path).resolve())
-                        vulns.append(Vulnerability(
-                            tool="cppcheck",
-                            file_path=abs_path,
-                            line=int(location.get("line", 0)),
-                            message=error.get("msg", ""),
-                            severity=error.get("severity", "info")
-                        ))
-        except ET.ParseError:
-            pass
+        with open(xml_path, "wb") as report:
+            source = _TeeReader(pipe, report)
+            try:
+                context = etree.iterparse(source, events=("end",), tag="error",
+                                          resolve_entities=False, no_network=True)
+                for _, error in context:
+                    location = error.find("location")
+                    if location is not None:
+                        file_path = location.get("file")
+                        if file_path:
+                            vulns.append(Vulnerability(
+                                tool="cppcheck",
+                                file_path=_resolve(file_path),
+                                line=int(location.get("line", 0)),
+                                message=error.get("msg", ""),
+                                severity=error.get("severity", "info")
+                            ))
+                    error.clear()
+                    while error.getprevious() is not None:
+                        del error.getparent()[0]
+            except etree.XMLSyntaxError:
+                pass
+
+            while source.read(65536):
+                pass
         
         return vulns
 
-    def _run_flawfinder(self) -> List[Vulnerability]:
-        csv_path = self.reports_dir / "flawfinder.csv"
-        cmd = f"flawfinder --quiet --csv {self.source_dir} > {csv_path}"
-        subprocess.run(cmd, shell=True)
+    async def _run_flawfinder(self) -> List[Vulnerability]:
+        cmd = ["flawfinder", "--quiet", "--csv", str(self.source_dir)]
+        return await self._run_streaming(cmd, self._parse_flawfinder)
 
+    def _parse_flawfinder(self, pipe: BinaryIO) -> List[Vulnerability]:
         vulns = []
-        if csv_path.exists():
-            with open(csv_path, 'r') as f:
-                lines = f.readlines()[1:]
-                for line in lines:
-                    parts = line.strip().split(',')
-                    if len(parts) >= 7:
-                        vulns.append(Vulnerability(
-                            tool="flawfinder",
-                            file_path=str(Path(parts[0]).resolve()),
-                            line=int(parts[1]) if parts[1].isdigit() else 0,
-                            message=parts[6],
-                            severity=parts[3]
-                        ))
+        with open(self.reports_dir / "flawfinder.csv", "w", newline="") as report:
+            reader = csv.reader(_tee_lines(io.TextIOWrapper(pipe, newline=""), report))
+            next(reader, None)
+            for row in reader:
+                if len(row) >= 7:
+                    vulns.append(Vulnerability(
+                        tool="flawfinder",
+                        file_path=_resolve(row[0]),
+                        line=int(row[1]) if row[1].isdigit() else 0,
+                        message=row[6],
+                        severity=row[3]
+                    ))
         return vulns
 
 class AIHealer:
-    def __init__(self, model_name: str, api_url: str = "http://localhost:11434/api/generate"):
+    def __init__(self, model_name: str, api_url: str = "http://localhost:11434/api/generate",
+                 max_concurrency: int = 8, batch_size: int = 10, num_ctx: int = 1024):
         self.model_name = model_name
         self.api_url = api_url
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.num_ctx = num_ctx
+        self._cache: Dict[Tuple[str, str], Dict] = {}
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.timeout = (5, 60)
+        self._payload_base = {"model": model_name, "format": "json", "stream": False}
+        self._fix_options = {"temperature": 0.1, "num_ctx": min(8192, num_ctx * batch_size), "num_predict": 200}
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset(["POST"]), read=False)
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def fix_file(self, file_path: str, vulnerabilities: List[Vulnerability]):
+        self.heal_all({file_path: sorted(vulnerabilities, key=attrgetter("line"))})
+
+    def heal_all(self, files_with_issues: Dict[str, List[Vulnerability]]):
+        asyncio.run(self._heal_all_async(files_with_issues))
+
+    async def _heal_all_async(self, files_with_issues: Dict[str, List[Vulnerability]]):
+        file_lines: Dict[str, List[str]] = {}
+        fixes: Dict[str, Dict[int, str]] = {}
+        pending_batches: Dict[str, int] = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            tasks = []
+            for file_path, vulnerabilities in files_with_issues.items():
+                try:
+                    with open(file_path, 'r') as f:
+                        lines = f.readlines()
+                except FileNotFoundError:
+                    console.print(f"[red]File not found: {file_path}[/red]")
+                    continue
+
+                file_lines[file_path] = lines
+                file_fixes = fixes[file_path] = {}
+                file_text = "".join(lines)
+                line_offsets = [0, *accumulate(map(len, lines))]
+                line_issues: Dict[int, List[Vulnerability]] = {}
+                for vuln in vulnerabilities:
+                    line_issues.setdefault(vuln.line, []).append(vuln)
+                targets = []
+                for vuln_group in self._group_vulnerabilities(vulnerabilities):
+                    if not vuln_group:
+                        continue
+
+                    primary_vuln = vuln_group[0]
+                    line_idx = primary_vuln.line - 1
+                    if 0 <= line_idx < len(lines):
+                        rule_match = self._rule_based_fix(lines[line_idx], line_issues[primary_vuln.line], file_text)
+                        if rule_match is not None:
+                            fixed_line = self._report_fix(file_path, lines[line_idx], *rule_match)
+                            if fixed_line is not None:
+                                file_fixes[line_idx] = fixed_line
+                            continue
+
+                        context_start = max(0, line_idx - 2)
+                        context_end = min(len(lines), line_idx + 3)
+                        code_context = file_text[line_offsets[context_start]:line_offsets[context_end]]
+                        targets.append((lines[line_idx], code_context, primary_vuln))
+
+                for i in range(0, len(targets), self.batch_size):
+                    tasks.append(self._fix_batch_async(
+                        semaphore, executor, file_path, targets[i:i + self.batch_size]
+                    ))
+                pending_batches[file_path] = -(-len(targets) // self.batch_size)
+                if pending_batches[file_path] == 0:
+                    self._apply_fixes(file_path, lines, fixes.pop(file_path))
+
+            for future in asyncio.as_completed(tasks):
+                file_path, results = await future
+                for line_idx, primary_vuln, fix_data in results:
+                    fixed_line = self._report_fix(file_path, file_lines[file_path][line_idx], primary_vuln, fix_data)
+                    if fixed_line is not None:
+                        fixes[file_path][line_idx] = fixed_line
+
+                pending_batches[file_path] -= 1
+                if pending_batches[file_path] == 0:
+                    self._apply_fixes(file_path, file_lines[file_path], fixes.pop(file_path))
+
+    async def _fix_batch_async(self, semaphore: asyncio.Semaphore, executor: ThreadPoolExecutor,
+                               file_path: str, items: List[Tuple[str, str, Vulnerability]]
+                               ) -> Tuple[str, List[Tuple[int, Vulnerability, Optional[Dict]]]]:
+        fixes: Dict[int, Optional[Dict]] = {}
+        misses = []
+        waiting = []
+        owned: Dict[Tuple[str, str], asyncio.Future] = {}
+        loop = asyncio.get_running_loop()
         try:
-            with open(file_path, 'r') as f:
-                lines = f.readlines()
-        except FileNotFoundError:
-            console.print(f"[red]File not found: {file_path}[/red]")
-            return
+            async with semaphore:
+                for item in items:
+                    cached_fix = self._get_cached_fix(item[0], item[2])
+                    if cached_fix is not None:
+                        fixes[item[2].line] = cached_fix
+                        continue
+                    key, _ = self._cache_key(item[0], item[2])
+                    if key in self._in_flight:
+                        waiting.append((item, self._in_flight[key]))
+                    else:
+                        owned[key] = self._in_flight[key] = loop.create_future()
+                        misses.append(item)
+                batch_fixes = {}
+                if misses:
+                    batch_fixes = await loop.run_in_executor(executor, self._query_llm_for_fixes_batch, misses)
 
-        grouped_vulns = self._group_vulnerabilities(vulnerabilities)
-        
-        modified_lines = lines[:]
-        fixed_count = 0
+            if batch_fixes is None:
+                fallback = await asyncio.gather(*(
+                    self._query_llm_for_fix_async(semaphore, executor, original_line, code_context, issue)
+                    for original_line, code_context, issue in misses
+                ))
+                batch_fixes = {issue.line: fix_data for (_, _, issue), fix_data in zip(misses, fallback)}
+
+            for original_line, _, issue in misses:
+                fix_data = batch_fixes.get(issue.line)
+                self._cache_fix(original_line, issue, fix_data)
+                fixes[issue.line] = fix_data
+        finally:
+            self._release_in_flight(owned)
+
+        for (original_line, _, issue), in_flight in waiting:
+            await in_flight
+            fixes[issue.line] = self._get_cached_fix(original_line, issue)
 
-        for vuln_group in grouped_vulns:
-            if not vuln_group:
+        return file_path, [(issue.line - 1, issue, fixes.get(issue.line)) for _, _, issue in items]
+
+    def _release_in_flight(self, owned: Dict[Tuple[str, str], asyncio.Future]):
+        for key, in_flight in owned.items():
+            del self._in_flight[key]
+            in_flight.set_result(None)
+
+    def _report_fix(self, file_path: str, original_line: str, primary_vuln: Vulnerability,
+                    fix_data: Optional[Dict]) -> Optional[str]:
+        indentation = self._get_indentation(original_line)
+
+        console.print(f"\n[yellow]Fixing {primary_vuln.tool} issue in {Path(file_path).name}:{primary_vuln.line}[/yellow]")
+        console.print(f"[dim]Vulnerability: {primary_vuln.message}[/dim]")
+        console.print(f"[dim]Original: {original_line.rstrip()}[/dim]")
+
+        if _has_fixed_line(fix_data):
+            fixed_content = fix_data['fixed_line'].rstrip()
+            fixed_line = indentation + fixed_content + '\n'
+
+            if fixed_line != original_line and len(fixed_content.strip()) > 0:
+                console.print(f"[green]✓ Fixed line {primary_vuln.line}:[/green]")
+                console.print(f"  [red]- {original_line.rstrip()}[/red]")
+                console.print(f"  [green]+ {fixed_line.rstrip()}[/green]")
+                console.print(f"  [blue]  Reason: {fix_data.get('reason', 'Security improvement')}[/blue]")
+                return fixed_line
+            console.print(f"[blue]~ No significant change needed[/blue]")
+        else:
+            console.print(f"[orange3]~ Could not generate fix[/orange3]")
+        return None
+
+    def _rule_based_fix(self, original_line: str, issues: List[Vulnerability],
+                        file_text: str) -> Optional[Tuple[Vulnerability, Dict]]:
+        for function, pattern, replacement, reason in _FIX_RULES:
+            issue = next((issue for issue in issues if re.search(rf"\b{function}\b", issue.message)), None)
+            if issue is None:
                 continue
-                
-            primary_vuln = vuln_group[0]
-            line_idx = primary_vuln.line - 1
-            
-            if 0 <= line_idx < len(modified_lines):
-                original_line = modified_lines[line_idx]
-                indentation = self._get_indentation(original_line)
-                
-                context_start = max(0, line_idx - 2)
-                context_end = min(len(modified_lines), line_idx + 3)
-                code_context = "".join(modified_lines[context_start:context_end])
-                
-                console.print(f"\n[yellow]Fixing {primary_vuln.tool} issue in {Path(file_path).name}:{primary_vuln.line}[/yellow]")
-                console.print(f"[dim]Vulnerability: {primary_vuln.message}[/dim]")
-                console.print(f"[dim]Original: {original_line.rstrip()}[/dim]")
-                
-                fix_data = self._query_llm_for_fix(original_line, code_context, primary_vuln)
-                
-                if fix_data and 'fixed_line' in fix_data:
-                    fixed_content = fix_data['fixed_line'].rstrip()
-                    fixed_line = indentation + fixed_content + '\n'
-
-                    if fixed_line != original_line and len(fixed_content.strip()) > 0:
-                        modified_lines[line_idx] = fixed_line
-                        fixed_count += 1
-                        console.print(f"[green]✓ Fixed line {primary_vuln.line}:[/green]")
-                        console.print(f"  [red]- {original_line.rstrip()}[/red]")
-                        console.print(f"  [green]+ {fixed_line.rstrip()}[/green]")
-                        console.print(f"  [blue]  Reason: {fix_data.get('reason', 'Security improvement')}[/blue]")
-                    else:
-                        console.print(f"[blue]~ No significant change needed[/blue]")
-                else:
-                    console.print(f"[orange3]~ Could not generate fix[/orange3]")
+            if not re.fullmatch(rf"\s*{function}\s*\([^;]*\)\s*;\s*", original_line):
+                continue
+            match = pattern.search(original_line)
+            if match is None:
+                continue
+            name = re.escape(match.group(1))
+            buffer_decl = (rf"^[ \t]*(?:(?:static|const|unsigned|signed)\s+)*char[ \t]+[^;()=\n]*"
+                           rf"\b{name}[ \t]*\[[^\]\n]+\][^;()\n]*[;=]")
+            if re.search(buffer_decl, file_text, re.MULTILINE) is None:
+                continue
+            pointer_or_param_decl = rf"\*\s*{name}\b|[(,]\s*(?:\w+\s+)*\w+[\s*]+{name}\s*[,)\[]"
+            if re.search(pointer_or_param_decl, file_text) is not None:
+                continue
+            fixed_line, _ = pattern.subn(replacement, original_line, count=1)
+            return issue, {"fixed_line": fixed_line.strip(), "reason": reason}
+        return None
+
+    def _cache_key(self, original_line: str, issue: Vulnerability) -> Tuple[Tuple[str, str], List[str]]:
+        names: Dict[str, int] = {}
+
+        def placeholder(match: re.Match) -> str:
+            if match.group("ident") is None:
+                return match.group(0)
+            return f"\0{names.setdefault(match.group(0), len(names))}\0"
+
+        canonical_line = _TOKEN_RE.sub(placeholder, original_line.strip())
+        return (issue.message, canonical_line), list(names)
+
+    def _get_cached_fix(self, original_line: str, issue: Vulnerability) -> Optional[Dict]:
+        key, names = self._cache_key(original_line, issue)
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        fixed_line = _PLACEHOLDER_RE.sub(lambda m: names[int(m.group(1))], cached['fixed_line'])
+        return {**cached, 'fixed_line': fixed_line}
+
+    def _cache_fix(self, original_line: str, issue: Vulnerability, fix_data: Optional[Dict]):
+        if not _has_fixed_line(fix_data):
+            return
+        if not set(_NUMBER_RE.findall(fix_data['fixed_line'])) <= set(_NUMBER_RE.findall(original_line)):
+            return
+        key, names = self._cache_key(original_line, issue)
+        positions = {name: i for i, name in enumerate(names)}
+
+        def placeholder(match: re.Match) -> str:
+            if match.group("ident") is None or match.group(0) not in positions:
+                return match.group(0)
+            return f"\0{positions[match.group(0)]}\0"
+
+        fixed_template = _TOKEN_RE.sub(placeholder, fix_data['fixed_line'])
+        self._cache[key] = {**fix_data, 'fixed_line': fixed_template}
+
+    def _apply_fixes(self, file_path: str, lines: List[str], fixes: Dict[int, str]):
+        modified_lines = lines[:]
+        for line_idx, fixed_line in fixes.items():
+            modified_lines[line_idx] = fixed_line
+        fixed_count = len(fixes)
 
         if fixed_count > 0:
             backup_path = Path(file_path).with_suffix('.bak')
-            shutil.copy2(file_path, backup_path)
-            console.print(f"\n[yellow]Backup created: {backup_path}[/yellow]")
-            
-            with open(file_path, 'w') as f:
+            new_path = file_path + ".new"
+            with open(new_path, 'w') as f:
                 f.writelines(modified_lines)
+            shutil.copymode(file_path, new_path)
+
+            os.replace(file_path, backup_path)
+            os.replace(new_path, file_path)
+            console.print(f"\n[yellow]Backup created: {backup_path}[/yellow]")
             
             console.print(f"[green]Fixed {fixed_count} issues in {Path(file_path).name}[/green]")
         else:
             console.print(f"[blue]No changes made to {Path(file_path).name}[/blue]")
 
     def _get_indentation(self, line: str) -> str:
-        stripped = line.lstrip()
-        if not stripped or stripped == '\n':
+        end = _INDENT_RE.match(line).end()
+        if end == len(line) or line[end] in '\r\n':
             return line
-        return line[:len(line) - len(stripped)]
+        return line[:end]
 
     def _group_vulnerabilities(self, vulnerabilities: List[Vulnerability]) -> List[List[Vulnerability]]:
         if not vulnerabilities:
             return []
         
-        sorted_vulns = sorted(vulnerabilities, key=lambda x: x.line)
         groups = []
-        current_group = [sorted_vulns[0]]
+        current_group = [vulnerabilities[0]]
         
-        for vuln in sorted_vulns[1:]:
-            if vuln.line - current_group[-1].line <= 3:
+        for vuln in vulnerabilities[1:]:
+            if vuln.line == current_group[-1].line:
+                if _severity_rank(vuln.severity) > _severity_rank(current_group[-1].severity):
+                    current_group[-1] = vuln
+            elif vuln.line - current_group[-1].line <= 3:
                 current_group.append(vuln)
             else:
                 groups.append(current_group)
@@ -180,49 +501,68 @@ class AIHealer:
             
         return groups
 
+    async def _query_llm_for_fix_async(self, semaphore: asyncio.Semaphore, executor: ThreadPoolExecutor,
+                                       original_line: str, code_context: str,
+                                       issue: Vulnerability) -> Optional[Dict]:
+        loop = asyncio.get_running_loop()
+        async with semaphore:
+            return await loop.run_in_executor(executor, self._query_llm_for_fix, original_line, code_context, issue)
+
+    def _query_llm_for_fixes_batch(self, items: List[Tuple[str, str, Vulnerability]]) -> Optional[Dict[int, Dict]]:
+        issues_text = "".join(
+            f"LINE {issue.line}\nVULN: {issue.message}\nTARGET: {original_line.strip()}\nCTX:\n{code_context}\n"
+            for original_line, code_context, issue in items
+        )
+        payload = {
+            **self._payload_base,
+            "prompt": f"{_PROMPT_HEAD}{issues_text}{_BATCH_PROMPT_TAIL}",
+            "options": {**self._fix_options, "num_predict": 128 * len(items)}
+        }
+
+        connect_timeout, read_timeout = self.timeout
+        try:
+            response = self.session.post(self.api_url, json=payload,
+                                         timeout=(connect_timeout, read_timeout * len(items)))
+            response.raise_for_status()
+            response_text = _json_loads(response.content).get("response", "{}")
+        except requests.exceptions.Timeout:
+            console.print(f"[red]LLM query timed out, skipping {len(items)} issues[/red]")
+            return {}
+        except Exception as e:
+            console.print(f"[red]LLM query failed: {e}[/red]")
+            return {}
+
+        try:
+            return {int(fix["line"]): fix for fix in _json_loads(response_text)["fixes"] if _has_fixed_line(fix)}
+        except (ValueError, KeyError, TypeError):
+            console.print("[orange3]~ Batched LLM response was not valid JSON, retrying issues one by one[/orange3]")
+            return None
+
     def _query_llm_for_fix(self, original_line: str, code_context: str, issue: Vulnerability) -> Optional[Dict]:
-        prompt = f"""
-        You are a secure C/C++ coding expert. Fix ONLY the specific vulnerability on the target line.
-
-        VULNERABILITY: {issue.message}
-        FILE: {issue.file_path}
-        TARGET LINE: {original_line}
-
-        SURROUNDING CODE:
-        {code_context}
-
-        INSTRUCTIONS:
-        - Fix ONLY the vulnerability in the target line
-        - Preserve all other functionality and logic
-        - Keep the same variable names and structure where possible
-        - Maintain the original indentation and formatting
-        - Return valid JSON with the corrected single line (without leading/trailing whitespace for indentation)
-        - Do NOT change surrounding lines unless absolutely necessary
-
-        JSON FORMAT:
-        {{
-            "reason": "Brief explanation of the fix",
-            "fixed_line": "The corrected content of the line (without indentation prefix)"
-        }}
-        """
-        
         payload = {
-            "model": self.model_name,
-            "prompt": prompt,
-            "format": "json",
-            "stream": False,
-            "options": {"temperature": 0.1, "num_ctx": 4096}
+            **self._payload_base,
+            "prompt": f"{_PROMPT_HEAD}VULN: {issue.message}\nTARGET: {original_line.strip()}\nCTX:\n{code_context}\n{_FIX_PROMPT_TAIL}",
+            "options": self._fix_options
         }
         
         try:
-            response = requests.post(self.api_url, json=payload)
+            response = self.session.post(self.api_url, json=payload, timeout=self.timeout)
             response.raise_for_status()
-            response_json = response.json()
-            return json.loads(response_json.get("response", "{}"))
+            response_json = _json_loads(response.content)
+            return _json_loads(response_json.get("response", "{}"))
+        except requests.exceptions.Timeout:
+            console.print(f"[red]LLM query timed out, skipping line {issue.line}[/red]")
+            return None
         except Exception as e:
             console.print(f"[red]LLM query failed: {e}[/red]")
             return None
 
+def _cow_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
 def setup_checked_folder(source_path: Path) -> Path:
     checked_path = source_path / "checked"
     if checked_path.exists():
@@ -236,19 +576,20 @@ def setup_checked_folder(source_path: Path) -> Path:
         dest = checked_path / item.name
         
         if item.is_dir():
-            shutil.copytree(item, dest)
+            shutil.copytree(item, dest, copy_function=_cow_copy)
         else:
-            shutil.copy2(item, dest)
+            _cow_copy(item, dest)
             
     return checked_path
 
 def main():
     if len(sys.argv) < 2:
-        console.print("[red]Usage: python script.py <source_folder> [model_name][/red]")
+        console.print("[red]Usage: python script.py <source_folder> [model_name] [num_ctx][/red]")
         sys.exit(1)
         
     source_folder = Path(sys.argv[1]).resolve()
-    model_name = sys.argv[2] if len(sys.argv) > 2 else "codellama:7b"
+    model_name = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_MODEL
+    num_ctx = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
     
     if not source_folder.exists():
         console.print(f"[red]Source folder does not exist: {source_folder}[/red]")
@@ -264,23 +605,34 @@ def main():
         console.print("[green]No issues found[/green]")
         sys.exit(0)
 
-    files_with_issues = {}
+    all_issues.sort(key=attrgetter("file_path", "line"))
+    unique_issues = []
+    seen = set()
     for issue in all_issues:
-        if issue.file_path not in files_with_issues:
-            files_with_issues[issue.file_path] = []
-        files_with_issues[issue.file_path].append(issue)
+        key = (issue.file_path, issue.line, issue.message)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique_issues.append(issue)
 
-    healer = AIHealer(model_name=model_name)
+    files_with_issues = {
+        file_path: list(issues) for file_path, issues in groupby(unique_issues, key=attrgetter("file_path"))
+    }
 
-    console.print(f"[bold]Found {len(all_issues)} issues in {len(files_with_issues)} files[/bold]")
+    healer = AIHealer(model_name=model_name, num_ctx=num_ctx)
 
+    console.print(f"[bold]Found {len(unique_issues)} issues in {len(files_with_issues)} files[/bold]")
+
+    files_to_heal = {}
     for file_path, issues in files_with_issues.items():
         file_obj = Path(file_path)
         if file_obj.exists():
-            console.print(f"\n[bold]Processing {file_obj.name}...[/bold]")
-            healer.fix_file(file_path, issues)
+            console.print(f"[bold]Queued {file_obj.name} ({len(issues)} issues)[/bold]")
+            files_to_heal[file_path] = issues
         else:
             console.print(f"[red]File not found: {file_path}[/red]")
+
+    healer.heal_all(files_to_heal)
             
     console.print(f"\n[bold green]Done. Results in {checked_folder}[/bold green]")
     console.print("[yellow]Remember to test the fixed code thoroughly![/yellow]")